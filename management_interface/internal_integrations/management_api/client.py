@@ -3,19 +3,60 @@ from datetime import date
 from typing import Optional, List
 
 import requests
-from fhir.resources.operationoutcome import OperationOutcome
+from requests.adapters import HTTPAdapter
 
 from internal_integrations.management_api.exceptions import ManagementAPIClientError
 
 from internal_integrations.management_api.settings import get_management_api_settings
 
+MAX_CONCURRENT_REQUESTS = 16
+
+# shared between client instances, so that connections to the management API are kept alive and reused
+_SESSION = requests.Session()
+_SESSION.mount(
+    "http://",
+    HTTPAdapter(pool_connections=1, pool_maxsize=MAX_CONCURRENT_REQUESTS),
+)
+_SESSION.mount(
+    "https://",
+    HTTPAdapter(pool_connections=1, pool_maxsize=MAX_CONCURRENT_REQUESTS),
+)
+
+# the same for every patient, so it is built once and shared between request bodies
+_NHS_NUMBER_VERIFICATION_STATUS_EXTENSION = {
+    "url": "https://fhir.hl7.org.uk/StructureDefinition/Extension-UKCore-NHSNumberVerificationStatus",
+    "valueCodeableConcept": {
+        "coding": [
+            {
+                "system": "https://fhir.hl7.org.uk/CodeSystem/UKCore-NHSNumberVerificationStatusEngland",
+                "code": "03",
+                "display": "Trace required",
+            }
+        ]
+    },
+}
+
+
+def _get_diagnostics(response: requests.Response) -> str:
+    """
+    Reads the diagnostics of the first issue of an OperationOutcome response. Only this one field is
+    needed, so the body is not validated into a full OperationOutcome model. Error responses that are
+    not an OperationOutcome (e.g. a plain text or JSON list from a proxy in front of the API) fall back
+    to their status.
+    """
+    try:
+        issues = response.json().get("issue") or [{}]
+        return issues[0].get("diagnostics", "")
+    except (ValueError, AttributeError, TypeError, LookupError):
+        return f"{response.status_code} {response.reason}"
+
 
 class ManagementAPIClient:
     def __init__(
         self, base_url: Optional[str] = None, session: Optional[requests.Session] = None
     ):
         self.base_url = base_url or get_management_api_settings().base_url
-        self.session = session or requests.Session()
+        self.session = session or _SESSION
 
     def create_subscription(
         self,
@@ -30,20 +71,7 @@ class ManagementAPIClient:
                 {
                     "system": "https://fhir.nhs.uk/Id/nhs-number",
                     "value": nhs_number,
-                    "extension": [
-                        {
-                            "url": "https://fhir.hl7.org.uk/StructureDefinition/Extension-UKCore-NHSNumberVerificationStatus",
-                            "valueCodeableConcept": {
-                                "coding": [
-                                    {
-                                        "system": "https://fhir.hl7.org.uk/CodeSystem/UKCore-NHSNumberVerificationStatusEngland",
-                                        "code": "03",
-                                        "display": "Trace required",
-                                    }
-                                ]
-                            },
-                        }
-                    ],
+                    "extension": [_NHS_NUMBER_VERIFICATION_STATUS_EXTENSION],
                 }
             ],
             "name": [
@@ -53,12 +81,11 @@ class ManagementAPIClient:
                     "given": patient_given_name,
                 }
             ],
-            "birthDate": str(birth_date),
+            "birthDate": birth_date.isoformat(),
         }
         response = self.session.post(f"{self.base_url}/subscription", json=body)
         if response.status_code >= 400:
-            operation_outcome = OperationOutcome(**response.json())
-            raise ManagementAPIClientError(operation_outcome.issue[0].diagnostics)
+            raise ManagementAPIClientError(_get_diagnostics(response))
 
         return uuid.UUID(response.headers.get("X-Subscription-Id"))
 
@@ -67,5 +94,4 @@ class ManagementAPIClient:
             f"{self.base_url}/subscription/{subscription_id}"
         )
         if response.status_code >= 400:
-            operation_outcome = OperationOutcome(**response.json())
-            raise ManagementAPIClientError(operation_outcome.issue[0].diagnostics)
+            raise ManagementAPIClientError(_get_diagnostics(response))
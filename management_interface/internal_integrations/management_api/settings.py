@@ -1,4 +1,4 @@
-from functools import lru_cache
+from functools import cache
 
 from pydantic import BaseSettings
 
@@ -10,6 +10,6 @@ class ManagementAPISettings(BaseSettings):
         env_prefix = "MANAGEMENT_API_"
 
 
-@lru_cache(maxsize=1)
+@cache
 def get_management_api_settings() -> ManagementAPISettings:
     return ManagementAPISettings()
@@ -0,0 +1,88 @@
+import uuid
+from datetime import date
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from internal_integrations.management_api.client import ManagementAPIClient
+from internal_integrations.management_api.exceptions import ManagementAPIClientError
+
+
+def create_response(status_code, headers=None, body=None):
+    response = MagicMock(status_code=status_code, headers=headers or {})
+    response.json.return_value = body
+    return response
+
+
+def create_operation_outcome(diagnostics):
+    return {
+        "resourceType": "OperationOutcome",
+        "issue": [{"severity": "error", "code": "invalid", "diagnostics": diagnostics}],
+    }
+
+
+class ManagementAPIClientTests(TestCase):
+    def setUp(self):
+        self.session = MagicMock()
+        self.client = ManagementAPIClient(base_url="http://tests", session=self.session)
+
+    def test_create_subscription(self):
+        subscription_id = uuid.uuid4()
+        self.session.post.return_value = create_response(
+            201, headers={"X-Subscription-Id": str(subscription_id)}
+        )
+
+        result = self.client.create_subscription(
+            patient_given_name=["John", "James"],
+            patient_family_name="Doe",
+            nhs_number="9728002440",
+            birth_date=date(1990, 1, 2),
+        )
+
+        self.assertEqual(result, subscription_id)
+        body = self.session.post.call_args.kwargs["json"]
+        self.assertEqual(body["identifier"][0]["value"], "9728002440")
+        self.assertEqual(body["name"][0]["given"], ["John", "James"])
+        self.assertEqual(body["name"][0]["family"], "Doe")
+        self.assertEqual(body["birthDate"], "1990-01-02")
+
+    def test_create_subscription_error(self):
+        self.session.post.return_value = create_response(
+            400, body=create_operation_outcome("Invalid NHS number")
+        )
+
+        with self.assertRaisesRegex(ManagementAPIClientError, "Invalid NHS number"):
+            self.client.create_subscription(
+                patient_given_name=["John"],
+                patient_family_name="Doe",
+                nhs_number="123",
+                birth_date=date(1990, 1, 2),
+            )
+
+    def test_delete_subscription_error(self):
+        self.session.delete.return_value = create_response(
+            404, body=create_operation_outcome("Subscription not found")
+        )
+
+        with self.assertRaisesRegex(ManagementAPIClientError, "Subscription not found"):
+            self.client.delete_subscription(uuid.uuid4())
+
+    def test_delete_subscription_error_without_json_body(self):
+        response = create_response(502)
+        response.reason = "Bad Gateway"
+        response.json.side_effect = ValueError
+        self.session.delete.return_value = response
+
+        with self.assertRaisesRegex(ManagementAPIClientError, "502 Bad Gateway"):
+            self.client.delete_subscription(uuid.uuid4())
+
+    def test_delete_subscription_error_with_json_body_other_than_operation_outcome(
+        self,
+    ):
+        for body in (["Bad Gateway"], "Bad Gateway", {"issue": ["Bad Gateway"]}):
+            with self.subTest(body=body):
+                response = create_response(502, body=body)
+                response.reason = "Bad Gateway"
+                self.session.delete.return_value = response
+
+                with self.assertRaisesRegex(ManagementAPIClientError, "502 Bad Gateway"):
+                    self.client.delete_subscription(uuid.uuid4())
@@ -1,25 +1,52 @@
 import csv
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
 from io import TextIOWrapper
-from typing import Iterable, List, Tuple, TypedDict
+from itertools import islice
+from operator import itemgetter
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    TypedDict,
+    Union,
+)
 from uuid import UUID
 from urllib.parse import quote
 
+import requests
 from django.conf import settings
 from django.contrib import admin, messages
 from django.contrib.auth import logout
 from django.core.exceptions import ValidationError
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from django.http import HttpResponse
-from django.shortcuts import redirect
+from django.shortcuts import get_object_or_404, redirect
 from django.template.response import TemplateResponse
 from django.urls import path
 from django.utils.html import format_html
-from internal_integrations.management_api.client import ManagementAPIClient
+from internal_integrations.management_api.client import (
+    MAX_CONCURRENT_REQUESTS,
+    ManagementAPIClient,
+)
 from internal_integrations.management_api.exceptions import ManagementAPIClientError
 
 from .configuration import SETTINGS
 from .enums import CSVImportMessages
-from .forms import CareProviderLocationForm, CareRecipientForm, RegisteredManagerForm
+from .forms import (
+    CareProviderLocationForm,
+    CareRecipientForm,
+    RegisteredManagerForm,
+    generate_nhs_number_hash,
+    normalise_nhs_number,
+)
 from .models import CareProviderLocation, CareRecipient, RegisteredManager
 
 
@@ -31,6 +58,20 @@ class _CareRecipientRecord(TypedDict):
     birth_date: str
 
 
+_CARE_RECIPIENT_RECORD_COLUMNS = frozenset(_CareRecipientRecord.__annotations__)
+_BULK_CREATE_BATCH_SIZE = 500
+# every scrypt hash in flight holds a 48 MiB scratchpad, so the number of concurrent hashes is kept small
+_NHS_NUMBER_HASHING_MAX_WORKERS = min(os.cpu_count() or 1, 4)
+
+
+class _CleanedCareRecipientRecord(TypedDict):
+    provider_reference_id: str
+    given_name: List[str]
+    family_name: str
+    nhs_number: str
+    birth_date: date
+
+
 def set_obj_created_updated(request, obj, form):
     """
     Updates created_by and updated_by fields if the object was created or changed in admin
@@ -54,10 +95,7 @@ def admin_logout_success(request):
 
 @admin.register(CareRecipient)
 class CareRecipientAdmin(admin.ModelAdmin):
-    search_fields = (
-        "nhs_number_hash",
-        "provider_reference_id",
-    )
+    search_fields = ("provider_reference_id",)
     list_filter = ("care_provider_location_id",)
     list_display = [
         "provider_reference_id",
@@ -75,6 +113,29 @@ class CareRecipientAdmin(admin.ModelAdmin):
 
         return fields
 
+    def get_queryset(self, request):
+        # the location is shown for every care recipient listed, deleted or displayed
+        return super().get_queryset(request).select_related("care_provider_location")
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        NHS number hashes are stored as bytes, so on top of the search_fields a care recipient can be
+        found by the full hex encoded hash of their NHS number.
+        """
+        # the changelist filters are already applied to the given queryset, so the hash match must narrow it too
+        filtered_queryset = queryset
+        queryset, may_have_duplicates = super().get_search_results(
+            request, queryset, search_term
+        )
+        try:
+            nhs_number_hash = bytes.fromhex(search_term)
+        except ValueError:
+            return queryset, may_have_duplicates
+
+        if nhs_number_hash:
+            queryset |= filtered_queryset.filter(nhs_number_hash=nhs_number_hash)
+        return queryset, may_have_duplicates
+
     def care_provider_location_name(self, obj):
         return obj.care_provider_location.name
 
@@ -83,21 +144,44 @@ class CareRecipientAdmin(admin.ModelAdmin):
         super().save_model(request, obj, form, change)
 
     def delete_queryset(self, request, queryset: Iterable[CareRecipient]):
-        for care_recipient in queryset:
+        care_recipients = list(queryset)
+        management_api_client = ManagementAPIClient()
+
+        # deleting a subscription is a round trip to the management API, so they are deleted concurrently.
+        # Errors (including transport errors) are reported per care recipient, so that one failing request
+        # does not keep the care recipients whose subscriptions were already deleted from being removed
+        def delete_subscription(
+            care_recipient: CareRecipient,
+        ) -> Optional[Exception]:
             try:
-                ManagementAPIClient().delete_subscription(
+                management_api_client.delete_subscription(
                     care_recipient.subscription_id
                 )
-                care_recipient.delete()
+            except (ManagementAPIClientError, requests.RequestException) as ex:
+                return ex
+            return None
+
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+            errors = list(executor.map(delete_subscription, care_recipients))
+
+        CareRecipient.objects.filter(
+            pk__in=[
+                care_recipient.pk
+                for care_recipient, error in zip(care_recipients, errors)
+                if error is None
+            ]
+        ).delete()
+        for care_recipient, error in zip(care_recipients, errors):
+            if error is None:
                 self.message_user(
                     request,
                     f"{care_recipient} was deleted successfully",
                     level=messages.INFO,
                 )
-            except ManagementAPIClientError as ex:
+            else:
                 self.message_user(
                     request,
-                    f"Could not delete {care_recipient}: {str(ex)}",
+                    f"Could not delete {care_recipient}: {str(error)}",
                     level=messages.ERROR,
                 )
 
@@ -153,6 +237,9 @@ class CareProviderLocationAdmin(admin.ModelAdmin):
         return my_urls + urls
 
     def import_care_recipients(self, request, care_provider_location_id: UUID):
+        care_provider_location = get_object_or_404(
+            CareProviderLocation, pk=care_provider_location_id
+        )
         context = dict(
             self.admin_site.each_context(request),
         )
@@ -164,26 +251,35 @@ class CareProviderLocationAdmin(admin.ModelAdmin):
                 return redirect("..")
 
             csv_file = TextIOWrapper(
-                request.FILES["csvfile"].file, encoding="utf-8", errors="replace"
+                request.FILES["csvfile"].file,
+                encoding="utf-8",
+                errors="replace",
+                newline="",
             )
+            reader = csv.reader(csv_file, delimiter=",")
             try:
-                # because it's not possible to rewind the reader, it's better to store its contents in list for
-                # multiple iterations
-                csv_data = []
-                for row in csv.DictReader(csv_file, delimiter=","):
-                    csv_data.append(_CareRecipientRecord(**{k.lower(): v for k, v in row.items()}))  # type: ignore
+                header = next(reader, None)
+                columns = [column.lower() for column in header] if header else None
+                if not self._is_csv_column_set_valid(columns):
+                    messages.error(
+                        request, message=f"{CSVImportMessages.INVALID_COLUMN_SET}"
+                    )
+                    return redirect("..")
+
+                # rows are parsed in a single pass, reading at most one row past the limit, so that
+                # oversized files are rejected without being parsed in full
+                csv_data = list(
+                    islice(
+                        self._read_care_recipient_records(reader, columns),  # type: ignore
+                        SETTINGS.CSV_IMPORT_MAX_LINES + 1,
+                    )
+                )
             except csv.Error:
                 messages.error(
                     request, message=f"{CSVImportMessages.FILE_CORRUPTED_OR_BINARY}"
                 )
                 return redirect("..")
 
-            if not self._is_csv_column_set_valid(csv_data):
-                messages.error(
-                    request, message=f"{CSVImportMessages.INVALID_COLUMN_SET}"
-                )
-                return redirect("..")
-
             if not self._is_csv_line_count_valid(csv_data):
                 messages.error(
                     request,
@@ -193,7 +289,7 @@ class CareProviderLocationAdmin(admin.ModelAdmin):
 
             created_care_recipients, errors = self._bulk_create_care_recipients(
                 csv_data=csv_data,
-                care_provider_location_id=care_provider_location_id,
+                care_provider_location=care_provider_location,
             )
             messages.info(
                 request,
@@ -236,51 +332,288 @@ class CareProviderLocationAdmin(admin.ModelAdmin):
     def _is_csv_line_count_valid(self, csv_data_list) -> bool:
         return len(csv_data_list) <= SETTINGS.CSV_IMPORT_MAX_LINES
 
-    def _is_csv_column_set_valid(self, csv_data_list) -> bool:
-        return set(_CareRecipientRecord.__annotations__) == set(csv_data_list[0])
+    def _is_csv_column_set_valid(self, csv_columns: Optional[Sequence[str]]) -> bool:
+        if not csv_columns:
+            return False
+        return _CARE_RECIPIENT_RECORD_COLUMNS == set(csv_columns)
+
+    def _read_care_recipient_records(
+        self, reader: Iterator[List[str]], columns: List[str]
+    ) -> Iterator[Union[_CareRecipientRecord, ValidationError]]:
+        """
+        Maps CSV rows to records by position, using the lowercased column names from the header,
+        rather than building a dict for every row as csv.DictReader would. Values cannot be matched
+        to columns in a row with more or fewer fields than the header (e.g. an unquoted comma in a
+        name), so a ValidationError is yielded for it instead of a record.
+        """
+        for row in reader:
+            # like csv.DictReader, skip blank lines
+            if not row:
+                continue
+            if len(row) != len(columns):
+                yield ValidationError(
+                    f"Row has {len(row)} field(s), expected {len(columns)} ({', '.join(columns)})"
+                )
+                continue
+            yield _CareRecipientRecord(zip(columns, row))  # type: ignore
 
     def _bulk_create_care_recipients(
-        self, csv_data: List[_CareRecipientRecord], care_provider_location_id: UUID
+        self,
+        csv_data: List[Union[_CareRecipientRecord, ValidationError]],
+        care_provider_location: CareProviderLocation,
     ) -> (List[CareRecipient], Tuple[str, Exception]):  # type: ignore
-        created_care_recipients = []
-        errors: List = []
+        # errors are kept with the index of their row, as the rows are checked in several passes
+        errors: List[Tuple[int, str, Exception]] = []
+        validated_records: List[Tuple[int, str, _CleanedCareRecipientRecord]] = []
+        provider_reference_ids: Set[str] = set()
+        care_recipient_records: List[Tuple[int, _CareRecipientRecord]] = []
         for counter, care_recipient_record in enumerate(csv_data):
-            form = CareRecipientForm(
-                data=dict(
-                    care_provider_location=care_provider_location_id,
-                    **care_recipient_record,
-                )
+            if isinstance(care_recipient_record, ValidationError):
+                errors.append((counter, f"line {counter}", care_recipient_record))
+            else:
+                care_recipient_records.append((counter, care_recipient_record))
+
+        # stripped like the form field does, so that the values compare equal to the ones that get saved
+        stripped_provider_reference_ids = [
+            record["provider_reference_id"].strip()
+            for _, record in care_recipient_records
+        ]
+        existing_provider_reference_ids = set(
+            CareRecipient.objects.filter(
+                provider_reference_id__in=stripped_provider_reference_ids
+            ).values_list("provider_reference_id", flat=True)
+        )
+        for (counter, care_recipient_record), provider_reference_id in zip(
+            care_recipient_records, stripped_provider_reference_ids
+        ):
+            line_reference = (
+                f"{care_recipient_record['provider_reference_id']} (line {counter})"
             )
-            if form.errors:
-                if form.non_field_errors().data:
-                    errors.extend(
-                        (
-                            f"{care_recipient_record['provider_reference_id']} (line {counter})",
-                            error,
-                        )
-                        for error in form.non_field_errors().data
-                    )
-                for field in form.errors:
-                    error_message = (
-                        f"Field: {field}, error(s): {' '.join(form.errors[field])}"
+            # checked upfront in a single query, so that rows imported before do not go through the expensive
+            # NHS number hashing only to be rejected
+            if provider_reference_id in existing_provider_reference_ids:
+                errors.append(
+                    (
+                        counter,
+                        line_reference,
+                        ValidationError(
+                            "Field: provider_reference_id, error(s): Care recipient with this Provider reference "
+                            "id already exists."
+                        ),
                     )
+                )
+                continue
+
+            try:
+                cleaned_record = self._clean_care_recipient_record(
+                    care_recipient_record
+                )
+            except ValidationError as exc:
+                for field, field_errors in exc.message_dict.items():
+                    error_message = f"Field: {field}, error(s): {' '.join(field_errors)}"
                     errors.append(
-                        (
-                            f"{care_recipient_record['provider_reference_id']} (line {counter})",
-                            ValidationError(error_message),
-                        )
+                        (counter, line_reference, ValidationError(error_message))
                     )
                 continue
 
-            try:
-                care_recipient = form.save()
-                created_care_recipients.append(care_recipient)
-            except IntegrityError as exc:
+            if cleaned_record["provider_reference_id"] in provider_reference_ids:
                 errors.append(
                     (
-                        f"{care_recipient_record['provider_reference_id']} (line {counter})",
-                        exc,
+                        counter,
+                        line_reference,
+                        ValidationError(
+                            "Care recipient with this provider reference ID already exists in the file"
+                        ),
                     )
                 )
+                continue
+            provider_reference_ids.add(cleaned_record["provider_reference_id"])
+            validated_records.append((counter, line_reference, cleaned_record))
+
+        cleaned_records: Dict[
+            bytes, Tuple[int, str, _CleanedCareRecipientRecord]
+        ] = {}
+        nhs_number_hashes = self._generate_nhs_number_hashes(
+            [cleaned_record for _, _, cleaned_record in validated_records]
+        )
+        for (counter, line_reference, cleaned_record), nhs_number_hash in zip(
+            validated_records, nhs_number_hashes
+        ):
+            if nhs_number_hash in cleaned_records:
+                errors.append(
+                    (
+                        counter,
+                        line_reference,
+                        ValidationError(
+                            f"Care recipient with this NHS number already exists in the file (with provider "
+                            f"reference ID {cleaned_records[nhs_number_hash][2]['provider_reference_id']})"
+                        ),
+                    )
+                )
+                continue
+            cleaned_records[nhs_number_hash] = (counter, line_reference, cleaned_record)
+
+        existing_nhs_number_hashes = CareRecipient.objects.filter(
+            nhs_number_hash__in=cleaned_records
+        ).values_list("nhs_number_hash", "provider_reference_id")
+        for nhs_number_hash, provider_reference_id in existing_nhs_number_hashes:
+            # Postgres returns binary fields as memoryview
+            counter, line_reference, _ = cleaned_records.pop(bytes(nhs_number_hash))
+            errors.append(
+                (
+                    counter,
+                    line_reference,
+                    ValidationError(
+                        f"Care recipient with this NHS number already exists in the database (with provider "
+                        f"reference ID {provider_reference_id})"
+                    ),
+                )
+            )
+
+        care_recipients = []
+        subscription_ids = self._create_subscriptions(
+            [cleaned_record for _, _, cleaned_record in cleaned_records.values()]
+        )
+        for (
+            nhs_number_hash,
+            (counter, line_reference, cleaned_record),
+        ), subscription_id in zip(cleaned_records.items(), subscription_ids):
+            if isinstance(subscription_id, ValidationError):
+                errors.append((counter, line_reference, subscription_id))
+                continue
+
+            care_recipient = CareRecipient(
+                care_provider_location=care_provider_location,
+                provider_reference_id=cleaned_record["provider_reference_id"],
+                nhs_number_hash=nhs_number_hash,
+                subscription_id=subscription_id,
+            )
+            care_recipients.append((counter, line_reference, care_recipient))
+
+        created_care_recipients = self._save_care_recipients(care_recipients, errors)
+        # the sort is stable, so several errors of the same row keep their order
+        errors.sort(key=itemgetter(0))
+        return created_care_recipients, [
+            (line_reference, error) for _, line_reference, error in errors
+        ]
+
+    def _clean_care_recipient_record(
+        self, care_recipient_record: _CareRecipientRecord
+    ) -> _CleanedCareRecipientRecord:
+        """
+        Validates a CSV record against the fields of CareRecipientForm, without the overhead of
+        instantiating a form for every row.
+        """
+        cleaned_data: Dict[str, Any] = {}
+        errors: Dict[str, List[str]] = {}
+        for field_name, value in care_recipient_record.items():
+            try:
+                if field_name == "birth_date":
+                    cleaned_data[field_name] = self._clean_birth_date(value)
+                else:
+                    cleaned_data[field_name] = CareRecipientForm.base_fields[
+                        field_name
+                    ].clean(value)
+            except ValidationError as exc:
+                errors[field_name] = exc.messages
+
+        if errors:
+            raise ValidationError(errors)
+
+        return _CleanedCareRecipientRecord(
+            provider_reference_id=cleaned_data["provider_reference_id"],
+            given_name=cleaned_data["given_name"].split(),
+            family_name=cleaned_data["family_name"],
+            nhs_number=normalise_nhs_number(cleaned_data["nhs_number"]),
+            birth_date=cleaned_data["birth_date"],
+        )
+
+    def _clean_birth_date(self, value: Any) -> date:
+        """
+        Birth dates are expected in ISO 8601 format, which is parsed directly rather than by trying each of
+        the form field's input formats in turn. Anything else still goes through the form field.
+        """
+        try:
+            return date.fromisoformat(value)
+        except (TypeError, ValueError):
+            return CareRecipientForm.base_fields["birth_date"].clean(value)
+
+    def _generate_nhs_number_hashes(
+        self, cleaned_records: List[_CleanedCareRecipientRecord]
+    ) -> List[bytes]:
+        """
+        hashlib.scrypt releases the GIL, so hashing in threads spreads the work over the available cores.
+        Results are returned in the order of the given records.
+        """
+        with ThreadPoolExecutor(max_workers=_NHS_NUMBER_HASHING_MAX_WORKERS) as executor:
+            return list(
+                executor.map(
+                    lambda cleaned_record: generate_nhs_number_hash(
+                        cleaned_record["nhs_number"], cleaned_record["birth_date"]
+                    ),
+                    cleaned_records,
+                )
+            )
+
+    def _create_subscriptions(
+        self, cleaned_records: List[_CleanedCareRecipientRecord]
+    ) -> List[Union[UUID, ValidationError]]:
+        """
+        Creating a subscription is a round trip to the management API, so they are created concurrently.
+        Results are returned in the order of the given records.
+        """
+        management_api_client = ManagementAPIClient()
+
+        def create_subscription(
+            cleaned_record: _CleanedCareRecipientRecord,
+        ) -> Union[UUID, ValidationError]:
+            try:
+                return management_api_client.create_subscription(
+                    patient_given_name=cleaned_record["given_name"],
+                    patient_family_name=cleaned_record["family_name"],
+                    nhs_number=cleaned_record["nhs_number"],
+                    birth_date=cleaned_record["birth_date"],
+                )
+            except ManagementAPIClientError as ex:
+                return ValidationError(str(ex))
+            # a transport error fails only its own row, so the subscriptions created for the others are still saved
+            except requests.RequestException as ex:
+                return ValidationError(f"Could not reach the management API: {ex}")
+
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+            return list(executor.map(create_subscription, cleaned_records))
+
+    def _save_care_recipients(
+        self,
+        care_recipients: List[Tuple[int, str, CareRecipient]],
+        errors: List[Tuple[int, str, Exception]],
+    ) -> List[CareRecipient]:
+        """
+        Inserts the care recipients in batches within a single transaction. Only a batch that fails on a
+        conflicting row (saved since the checks in _bulk_create_care_recipients) is retried row by row.
+        """
+        created_care_recipients: List[CareRecipient] = []
+        with transaction.atomic():
+            for batch_start in range(0, len(care_recipients), _BULK_CREATE_BATCH_SIZE):
+                batch_end = batch_start + _BULK_CREATE_BATCH_SIZE
+                batch = care_recipients[batch_start:batch_end]
+                try:
+                    with transaction.atomic():
+                        created_care_recipients.extend(
+                            CareRecipient.objects.bulk_create(
+                                [care_recipient for _, _, care_recipient in batch]
+                            )
+                        )
+                    continue
+                except IntegrityError:
+                    pass
+
+                for counter, line_reference, care_recipient in batch:
+                    try:
+                        with transaction.atomic():
+                            care_recipient.save(force_insert=True)
+                        created_care_recipients.append(care_recipient)
+                    except IntegrityError as exc:
+                        errors.append((counter, line_reference, exc))
 
-        return created_care_recipients, errors
+        return created_care_recipients
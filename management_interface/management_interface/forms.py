@@ -1,4 +1,5 @@
 import uuid
+from datetime import date
 from hashlib import scrypt
 
 from django import forms
@@ -9,6 +10,37 @@ from internal_integrations.management_api.exceptions import ManagementAPIClientE
 from .models import CareProviderLocation, CareRecipient, RegisteredManager
 
 
+# deletes every character str.split() treats as whitespace, the last of which is U+3000
+_WHITESPACE_DELETION_TABLE = str.maketrans(
+    "", "", "".join(char for char in map(chr, range(0x3001)) if char.isspace())
+)
+
+
+def normalise_nhs_number(nhs_number: str) -> str:
+    return nhs_number.translate(_WHITESPACE_DELETION_TABLE)
+
+
+# https://nhsx.github.io/il-hans-infrastructure/adrs/003-Do-not-use-NEMS-or-MESH
+# The hash is the pseudonymous identifier other HANS components search by, and NHS numbers are not stored to
+# rehash them, so these parameters cannot be changed here alone. Memory use is 128 * n * r bytes (48 MiB), as
+# the p lanes are computed one after another.
+_SCRYPT_N = 32768
+_SCRYPT_R = 12
+_SCRYPT_P = 6
+_SCRYPT_MAXMEM = 2**26
+
+
+def generate_nhs_number_hash(nhs_number: str, birth_date: date) -> bytes:
+    return scrypt(
+        nhs_number.encode(),
+        salt=str(birth_date).encode(),
+        n=_SCRYPT_N,
+        r=_SCRYPT_R,
+        p=_SCRYPT_P,
+        maxmem=_SCRYPT_MAXMEM,
+    )
+
+
 class CareProviderLocationForm(forms.ModelForm):
     class Meta:
         model = CareProviderLocation
@@ -47,22 +79,24 @@ class CareRecipientForm(forms.ModelForm):
         if self.errors:
             return
 
-        self.cleaned_data["nhs_number"] = "".join(
-            self.cleaned_data["nhs_number"].split()
+        self.cleaned_data["nhs_number"] = normalise_nhs_number(
+            self.cleaned_data["nhs_number"]
         )
         self.cleaned_data["nhs_number_hash"] = self._generate_nhs_number_hash()
-        already_existing_care_recipient = CareRecipient.objects.filter(
-            nhs_number_hash=self.cleaned_data["nhs_number_hash"]
+        already_existing_care_recipient = (
+            CareRecipient.objects.filter(
+                nhs_number_hash=self.cleaned_data["nhs_number_hash"]
+            )
+            .only("provider_reference_id")
+            .first()
         )
         if already_existing_care_recipient:
             raise ValidationError(
                 f"Care recipient with this NHS number already exists in the database (with provider reference ID "
-                f"{already_existing_care_recipient[0].provider_reference_id})"
+                f"{already_existing_care_recipient.provider_reference_id})"
             )
 
-        self.cleaned_data["given_name"] = [
-            name.strip() for name in self.cleaned_data["given_name"].split()
-        ]
+        self.cleaned_data["given_name"] = self.cleaned_data["given_name"].split()
         self.cleaned_data["subscription_id"] = self._create_subscription()
         return super().clean()
 
@@ -82,13 +116,10 @@ class CareRecipientForm(forms.ModelForm):
         except ManagementAPIClientError as ex:
             raise ValidationError(str(ex))
 
-    def _generate_nhs_number_hash(self) -> str:
-        # https://nhsx.github.io/il-hans-infrastructure/adrs/003-Do-not-use-NEMS-or-MESH
-        return scrypt(
-            self.cleaned_data["nhs_number"].encode(),
-            salt=str(self.cleaned_data["birth_date"]).encode(),
-            n=32768,
-            r=12,
-            p=6,
-            maxmem=2**26,
-        ).hex()
+    def _generate_nhs_number_hash(self) -> bytes:
+        # memoised on the form, so that cleaning it again (e.g. an explicit full_clean()) does not pay for scrypt twice
+        hash_inputs = (self.cleaned_data["nhs_number"], self.cleaned_data["birth_date"])
+        if getattr(self, "_nhs_number_hash_inputs", None) != hash_inputs:
+            self._nhs_number_hash = generate_nhs_number_hash(*hash_inputs)
+            self._nhs_number_hash_inputs = hash_inputs
+        return self._nhs_number_hash
@@ -0,0 +1,59 @@
+from django.db import migrations, models
+
+
+def convert_nhs_number_hashes_to_bytes(apps, schema_editor):
+    CareRecipient = apps.get_model("management_interface", "CareRecipient")
+    for care_recipient in CareRecipient.objects.only("nhs_number_hash"):
+        care_recipient.nhs_number_hash_bytes = bytes.fromhex(
+            care_recipient.nhs_number_hash
+        )
+        care_recipient.save(update_fields=["nhs_number_hash_bytes"])
+
+
+def convert_nhs_number_hashes_to_hex(apps, schema_editor):
+    CareRecipient = apps.get_model("management_interface", "CareRecipient")
+    for care_recipient in CareRecipient.objects.only("nhs_number_hash_bytes"):
+        care_recipient.nhs_number_hash = bytes(
+            care_recipient.nhs_number_hash_bytes
+        ).hex()
+        care_recipient.save(update_fields=["nhs_number_hash"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("management_interface", "0003_alter_carerecipient_nhs_number_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="carerecipient",
+            name="nhs_number_hash_bytes",
+            field=models.BinaryField(editable=False, max_length=64, null=True),
+        ),
+        migrations.AlterField(
+            model_name="carerecipient",
+            name="nhs_number_hash",
+            field=models.CharField(
+                db_index=True, editable=False, max_length=128, null=True, unique=True
+            ),
+        ),
+        migrations.RunPython(
+            convert_nhs_number_hashes_to_bytes, convert_nhs_number_hashes_to_hex
+        ),
+        migrations.RemoveField(
+            model_name="carerecipient",
+            name="nhs_number_hash",
+        ),
+        migrations.RenameField(
+            model_name="carerecipient",
+            old_name="nhs_number_hash_bytes",
+            new_name="nhs_number_hash",
+        ),
+        migrations.AlterField(
+            model_name="carerecipient",
+            name="nhs_number_hash",
+            field=models.BinaryField(
+                db_index=True, editable=False, max_length=64, unique=True
+            ),
+        ),
+    ]
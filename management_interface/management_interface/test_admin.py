@@ -4,6 +4,7 @@ from unittest import mock
 from unittest.mock import MagicMock
 from uuid import uuid4
 
+import requests
 from django.contrib.admin import AdminSite
 from django.test import TestCase
 
@@ -26,10 +27,79 @@ class CareRecipientAdminTests(TestCase):
             name="Test Location", registered_manager_id=self.registered_manager.pk
         )
 
+    def test_get_queryset__fetches_care_provider_location(self):
+        for _ in range(3):
+            CareRecipient.objects.create(
+                care_provider_location=self.location,
+                nhs_number_hash=random.randbytes(64),
+                subscription_id=uuid4(),
+                provider_reference_id=f"AX{random.randint(10000, 99999)}",
+            )
+
+        with self.assertNumQueries(1):
+            location_names = [
+                self.care_recipient_admin.care_provider_location_name(care_recipient)
+                for care_recipient in self.care_recipient_admin.get_queryset(
+                    request=MagicMock()
+                )
+            ]
+
+        assert location_names == ["Test Location"] * 3
+
+    def test_get_search_results__finds_care_recipient_by_hex_nhs_number_hash(self):
+        care_recipient = CareRecipient.objects.create(
+            care_provider_location=self.location,
+            nhs_number_hash=random.randbytes(64),
+            subscription_id=uuid4(),
+            provider_reference_id="AX812938",
+        )
+        CareRecipient.objects.create(
+            care_provider_location=self.location,
+            nhs_number_hash=random.randbytes(64),
+            subscription_id=uuid4(),
+            provider_reference_id="AX812939",
+        )
+        request = MagicMock()
+
+        queryset, _ = self.care_recipient_admin.get_search_results(
+            request,
+            self.care_recipient_admin.get_queryset(request),
+            care_recipient.nhs_number_hash.hex(),
+        )
+
+        assert [obj.provider_reference_id for obj in queryset] == [
+            care_recipient.provider_reference_id
+        ]
+
+    def test_get_search_results__hex_nhs_number_hash_keeps_changelist_filters(self):
+        other_location = CareProviderLocation.objects.create(
+            name="Other Location",
+            ods_code="XXXABCD",
+            cqc_location_id="1-11000000001",
+            registered_manager_id=self.registered_manager.pk,
+        )
+        care_recipient = CareRecipient.objects.create(
+            care_provider_location=other_location,
+            nhs_number_hash=random.randbytes(64),
+            subscription_id=uuid4(),
+            provider_reference_id="AX812938",
+        )
+        request = MagicMock()
+
+        queryset, _ = self.care_recipient_admin.get_search_results(
+            request,
+            self.care_recipient_admin.get_queryset(request).filter(
+                care_provider_location_id=self.location.pk
+            ),
+            care_recipient.nhs_number_hash.hex(),
+        )
+
+        assert list(queryset) == []
+
     def test_delete_care_recipient__single_object__removal_is_successful(self):
         care_recipient = CareRecipient.objects.create(
             care_provider_location=self.location,
-            nhs_number_hash="1234567",
+            nhs_number_hash=b"1234567",
             subscription_id=uuid4(),
             provider_reference_id="AX812938",
         )
@@ -48,7 +118,7 @@ class CareRecipientAdminTests(TestCase):
     def test_delete_care_recipient__single_object__removal_is_unsuccessful(self):
         care_recipient = CareRecipient.objects.create(
             care_provider_location=self.location,
-            nhs_number_hash="1234567",
+            nhs_number_hash=b"1234567",
             subscription_id=uuid4(),
             provider_reference_id="AX812938",
         )
@@ -68,7 +138,7 @@ class CareRecipientAdminTests(TestCase):
         [
             CareRecipient.objects.create(
                 care_provider_location=self.location,
-                nhs_number_hash=str(random.randint(10000000, 99999999)),
+                nhs_number_hash=random.randbytes(64),
                 subscription_id=uuid4(),
                 provider_reference_id=f"AX{random.randint(10000, 99999)}",
             )
@@ -90,7 +160,7 @@ class CareRecipientAdminTests(TestCase):
         [
             CareRecipient.objects.create(
                 care_provider_location=self.location,
-                nhs_number_hash=str(random.randint(10000000, 99999999)),
+                nhs_number_hash=random.randbytes(64),
                 subscription_id=uuid4(),
                 provider_reference_id=f"AX{random.randint(10000, 99999)}",
             )
@@ -114,7 +184,7 @@ class CareRecipientAdminTests(TestCase):
         [
             CareRecipient.objects.create(
                 care_provider_location=self.location,
-                nhs_number_hash=str(random.randint(10000000, 99999999)),
+                nhs_number_hash=random.randbytes(64),
                 subscription_id=uuid4(),
                 provider_reference_id=f"AX{random.randint(10000, 99999)}",
             )
@@ -131,3 +201,27 @@ class CareRecipientAdminTests(TestCase):
 
         assert delete_subscription_mocked.call_count == 3
         assert CareRecipient.objects.count() == 1
+
+    def test_delete_care_recipient__multiple_objects__connection_error_removes_the_others(
+        self,
+    ):
+        [
+            CareRecipient.objects.create(
+                care_provider_location=self.location,
+                nhs_number_hash=random.randbytes(64),
+                subscription_id=uuid4(),
+                provider_reference_id=f"AX{random.randint(10000, 99999)}",
+            )
+            for _ in range(3)
+        ]
+        with mock.patch.object(
+            ManagementAPIClient,
+            ManagementAPIClient.delete_subscription.__name__,
+            MagicMock(side_effect=[None, requests.ConnectionError, None]),
+        ) as delete_subscription_mocked:
+            self.care_recipient_admin.delete_queryset(
+                request=MagicMock(), queryset=CareRecipient.objects.get_queryset()
+            )
+
+        assert delete_subscription_mocked.call_count == 3
+        assert CareRecipient.objects.count() == 1
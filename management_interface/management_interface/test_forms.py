@@ -1,13 +1,29 @@
+from datetime import date
 from unittest import mock
 from unittest.mock import MagicMock
 from uuid import uuid4
 
 from django.test import TestCase
 
-from .forms import CareRecipientForm
+from .fakes import generate_nhs_number_hash_fast
+from .forms import CareRecipientForm, generate_nhs_number_hash
 from .models import CareProviderLocation, RegisteredManager
 
 
+class GenerateNHSNumberHashTests(TestCase):
+    def test_generate_nhs_number_hash(self):
+        # the hash is the pseudonymous identifier shared with other HANS components, so it must not change
+        self.assertEqual(
+            generate_nhs_number_hash("9728002440", date(2012, 7, 19)).hex(),
+            "ee09dc6223c0d50042b72e4f3989c44528bdd6e1b9a7b9cadb81102544400e75"
+            "d60f531f44fd1291015174c130cf1f91122c48884cb6ee5d1694299db724b3f6",
+        )
+
+
+@mock.patch(
+    "management_interface.forms.generate_nhs_number_hash",
+    new=generate_nhs_number_hash_fast,
+)
 class CareRecipientFormTests(TestCase):
     def setUp(self):
         self.registered_manager = RegisteredManager.objects.create(
@@ -81,3 +97,28 @@ class CareRecipientFormTests(TestCase):
             assert not form2.is_valid()
             assert "already exists" in str(form2.errors)
             assert "PRVDRFID" in str(form2.errors)
+
+    def test_nhs_number_hash_is_computed_once_per_form(self):
+        with mock.patch.object(
+            CareRecipientForm,
+            CareRecipientForm._create_subscription.__name__,
+            MagicMock(return_value=uuid4()),
+        ), mock.patch(
+            "management_interface.forms.generate_nhs_number_hash",
+            MagicMock(return_value=b"1234567"),
+        ) as generate_nhs_number_hash_mocked:
+            form = CareRecipientForm(
+                data=dict(
+                    provider_reference_id="PRVDRFID",
+                    given_name="John",
+                    family_name="Doe",
+                    nhs_number="123456789",
+                    care_provider_location=self.location.pk,
+                    birth_date="1990-01-01",
+                )
+            )
+            assert form.is_valid()
+            form.full_clean()
+            assert form.is_valid()
+
+        assert generate_nhs_number_hash_mocked.call_count == 1
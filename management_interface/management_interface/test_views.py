@@ -1,16 +1,22 @@
+import csv
 import os
+from dataclasses import replace
+from datetime import date
 from http import HTTPStatus
 from unittest import mock
 from unittest.mock import MagicMock
 from uuid import uuid4
 
+import requests
 from django.contrib.auth.models import User
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import Client, TestCase
 from django.urls import reverse
+from internal_integrations.management_api.client import ManagementAPIClient
 
+from .configuration import SETTINGS
 from .enums import CSVImportMessages
-from .forms import CareRecipientForm
+from .fakes import generate_nhs_number_hash_fast
 from .models import CareRecipient, RegisteredManager
 
 
@@ -28,7 +34,9 @@ class CareProviderLocationTests(TestCase):
             cqc_location_id="My CQC Location ID",
         )
         self.care_recipient = self.location.carerecipient_set.create(
-            subscription_id=uuid4(), provider_reference_id="foobar"
+            subscription_id=uuid4(),
+            provider_reference_id="foobar",
+            nhs_number_hash=b"1234567",
         )
         self.care_recipient.nhs_number = "password"
         self.care_recipient.save()
@@ -40,14 +48,14 @@ class CareProviderLocationTests(TestCase):
     def test_search_get_method_not_allowed(self):
         url = reverse("care_provider_search")
         response = self.client.get(
-            url, {"_careRecipientPseudoId": self.care_recipient.nhs_number_hash}
+            url, {"_careRecipientPseudoId": self.care_recipient.nhs_number_hash.hex()}
         )
         self.assertFailure(response, HTTPStatus.METHOD_NOT_ALLOWED, "not-allowed")
 
     def test_successful_search(self):
         url = reverse("care_provider_search")
         response = self.client.post(
-            url, {"_careRecipientPseudoId": self.care_recipient.nhs_number_hash}
+            url, {"_careRecipientPseudoId": self.care_recipient.nhs_number_hash.hex()}
         )
         self.assertEqual(response.status_code, HTTPStatus.OK)
         self.assertEqual(response.json()["name"], self.location.name)
@@ -63,6 +71,11 @@ class CareProviderLocationTests(TestCase):
         self.assertFailure(response, HTTPStatus.BAD_REQUEST, "required")
 
 
+@mock.patch.dict(os.environ, {"MANAGEMENT_API_BASE_URL": "http://tests"})
+@mock.patch(
+    "management_interface.admin.generate_nhs_number_hash",
+    new=generate_nhs_number_hash_fast,
+)
 class AdminCareProviderLocationTests(TestCase):
     def _convert_messages_to_str(self, response):
         return "".join([str(message) for message in list(response.context["messages"])])
@@ -131,29 +144,78 @@ class AdminCareProviderLocationTests(TestCase):
         self.assertIn(CSVImportMessages.INVALID_COLUMN_SET.value, messages)
         self.assertEqual(CareRecipient.objects.count(), 0)
 
+    def test_admin_upload_csv_file_to_not_existing_location(self):
+        csv_file = self._upload_test_data("patients_test_data.csv")
+        with mock.patch.object(
+            ManagementAPIClient,
+            ManagementAPIClient.create_subscription.__name__,
+            MagicMock(side_effect=lambda **_: uuid4()),
+        ) as create_subscription_mocked:
+            response = self.client.post(
+                reverse("admin:import_care_recipients", args=(uuid4(),)),
+                {"csvfile": csv_file},
+            )
+
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        self.assertEqual(create_subscription_mocked.call_count, 0)
+        self.assertEqual(CareRecipient.objects.count(), 0)
+
+    def test_admin_upload_csv_file_exceeding_line_count(self):
+        csv_file = self._upload_test_data("patients_test_data.csv")
+        with mock.patch(
+            "management_interface.admin.SETTINGS",
+            replace(SETTINGS, CSV_IMPORT_MAX_LINES=2),
+        ):
+            response = self._get_upload_file_response(csv_file)
+        messages = self._convert_messages_to_str(response)
+        self.assertIn(CSVImportMessages.LINE_COUNT_EXCEEDED.value, messages)
+        self.assertEqual(CareRecipient.objects.count(), 0)
+
+    def test_admin_upload_csv_file_exceeding_line_count_is_not_parsed_in_full(self):
+        with open(
+            os.path.join(os.path.dirname(__file__), "test_files/patients_test_data.csv"),
+            "rb",
+        ) as file:
+            # rows past the limit are never read, so the field over the csv module's size limit at the end
+            # (which fails parsing on every Python version) is not reached
+            csv_file = SimpleUploadedFile(
+                "patients_test_data.csv",
+                file.read() + b"x" * (csv.field_size_limit() + 1) + b"\n",
+                content_type="text/csv",
+            )
+        with mock.patch(
+            "management_interface.admin.SETTINGS",
+            replace(SETTINGS, CSV_IMPORT_MAX_LINES=2),
+        ):
+            response = self._get_upload_file_response(csv_file)
+        messages = self._convert_messages_to_str(response)
+        self.assertIn(CSVImportMessages.LINE_COUNT_EXCEEDED.value, messages)
+        self.assertNotIn(CSVImportMessages.FILE_CORRUPTED_OR_BINARY.value, messages)
+        self.assertEqual(CareRecipient.objects.count(), 0)
+
     def test_admin_upload_csv_file_successfully(self):
         csv_file = self._upload_test_data("patients_test_data.csv")
         with mock.patch.object(
-            CareRecipientForm,
-            CareRecipientForm._create_subscription.__name__,
-            MagicMock(side_effect=uuid4),
-        ) as _create_subscription_mocked:
+            ManagementAPIClient,
+            ManagementAPIClient.create_subscription.__name__,
+            MagicMock(side_effect=lambda **_: uuid4()),
+        ) as create_subscription_mocked:
             response = self._get_upload_file_response(csv_file)
             csv_file.seek(0)
             lines_count = len(csv_file.readlines())
             messages = self._convert_messages_to_str(response)
 
-        self.assertEqual(_create_subscription_mocked.call_count, lines_count - 1)
+        self.assertEqual(create_subscription_mocked.call_count, lines_count - 1)
         self.assertIn(CSVImportMessages.FILE_IMPORTED_SUCCESSFULLY.value, messages)
         self.assertEqual(CareRecipient.objects.count(), lines_count - 1)
 
     def test_admin_upload_csv_file_with_broken_row(self):
         csv_file = self._upload_test_data("patients_invalid_row_test_data.csv")
         with mock.patch.object(
-            CareRecipientForm,
-            CareRecipientForm._create_subscription.__name__,
-            MagicMock(side_effect=uuid4),
-        ) as _create_subscription_mocked:
+            ManagementAPIClient,
+            ManagementAPIClient.create_subscription.__name__,
+            MagicMock(side_effect=lambda **_: uuid4()),
+        ) as create_subscription_mocked:
             response = self._get_upload_file_response(csv_file)
             csv_file.seek(0)
             lines_count = len(csv_file.readlines())
@@ -161,9 +223,198 @@ class AdminCareProviderLocationTests(TestCase):
         self.assertIn(CSVImportMessages.FILE_IMPORTED_SUCCESSFULLY.value, messages)
         self.assertIn("error(s)", messages)
         self.assertEqual(
-            _create_subscription_mocked.call_count, lines_count - 3
+            create_subscription_mocked.call_count, lines_count - 3
         )  # header + two invalid rows
 
+    def test_admin_upload_csv_file_with_row_with_more_fields_than_header(self):
+        csv_file = SimpleUploadedFile(
+            "patients_test_data.csv",
+            b"NHS_NUMBER,BIRTH_DATE,FAMILY_NAME,GIVEN_NAME,PROVIDER_REFERENCE_ID\n"
+            b"9728002440,2012-07-19,Simon,Orpah Carmel,CP_066D4889\n"
+            b"9728002459,2009-08-20,Smith, Jr,John,CP_1\n",
+            content_type="text/csv",
+        )
+        with mock.patch.object(
+            ManagementAPIClient,
+            ManagementAPIClient.create_subscription.__name__,
+            MagicMock(side_effect=lambda **_: uuid4()),
+        ) as create_subscription_mocked:
+            response = self._get_upload_file_response(csv_file)
+            messages = self._convert_messages_to_str(response)
+
+        self.assertIn("line 1: Row has 6 field(s), expected 5", messages)
+        self.assertEqual(create_subscription_mocked.call_count, 1)
+        self.assertEqual(
+            list(CareRecipient.objects.values_list("provider_reference_id", flat=True)),
+            ["CP_066D4889"],
+        )
+
+    def test_admin_upload_csv_file_with_already_imported_rows(self):
+        self.location.carerecipient_set.create(
+            subscription_id=uuid4(),
+            provider_reference_id="CP_066D4889",
+            nhs_number_hash=b"1234567",
+        )
+        csv_file = self._upload_test_data("patients_test_data.csv")
+        with mock.patch.object(
+            ManagementAPIClient,
+            ManagementAPIClient.create_subscription.__name__,
+            MagicMock(side_effect=lambda **_: uuid4()),
+        ) as create_subscription_mocked:
+            response = self._get_upload_file_response(csv_file)
+            csv_file.seek(0)
+            lines_count = len(csv_file.readlines())
+            messages = self._convert_messages_to_str(response)
+
+        self.assertIn("CP_066D4889 (line 0)", messages)
+        self.assertIn("already exists", messages)
+        self.assertEqual(create_subscription_mocked.call_count, lines_count - 2)
+        self.assertEqual(CareRecipient.objects.count(), lines_count - 1)
+
+    def test_admin_upload_csv_file_with_already_imported_rows_padded_with_whitespace(
+        self,
+    ):
+        self.location.carerecipient_set.create(
+            subscription_id=uuid4(),
+            provider_reference_id="CP_066D4889",
+            nhs_number_hash=b"1234567",
+        )
+        csv_file = SimpleUploadedFile(
+            "patients_test_data.csv",
+            b"NHS_NUMBER,BIRTH_DATE,FAMILY_NAME,GIVEN_NAME,PROVIDER_REFERENCE_ID\n"
+            b"9728002440,2012-07-19,Simon,Orpah Carmel,CP_066D4889 \n",
+            content_type="text/csv",
+        )
+        with mock.patch.object(
+            ManagementAPIClient,
+            ManagementAPIClient.create_subscription.__name__,
+            MagicMock(side_effect=lambda **_: uuid4()),
+        ) as create_subscription_mocked:
+            response = self._get_upload_file_response(csv_file)
+            messages = self._convert_messages_to_str(response)
+
+        self.assertIn("already exists", messages)
+        self.assertEqual(create_subscription_mocked.call_count, 0)
+        self.assertEqual(CareRecipient.objects.count(), 1)
+
+    def test_admin_upload_csv_file_with_nhs_number_already_in_database(self):
+        self.location.carerecipient_set.create(
+            subscription_id=uuid4(),
+            provider_reference_id="EXISTING",
+            nhs_number_hash=generate_nhs_number_hash_fast(
+                "9728002440", date(2012, 7, 19)
+            ),
+        )
+        csv_file = self._upload_test_data("patients_test_data.csv")
+        with mock.patch.object(
+            ManagementAPIClient,
+            ManagementAPIClient.create_subscription.__name__,
+            MagicMock(side_effect=lambda **_: uuid4()),
+        ) as create_subscription_mocked:
+            response = self._get_upload_file_response(csv_file)
+            csv_file.seek(0)
+            lines_count = len(csv_file.readlines())
+            messages = self._convert_messages_to_str(response)
+
+        self.assertIn("CP_066D4889 (line 0)", messages)
+        self.assertIn("already exists in the database", messages)
+        self.assertIn("EXISTING", messages)
+        self.assertEqual(create_subscription_mocked.call_count, lines_count - 2)
+        self.assertEqual(CareRecipient.objects.count(), lines_count - 1)
+
+    def test_admin_upload_csv_file_reports_errors_in_line_order(self):
+        self.location.carerecipient_set.create(
+            subscription_id=uuid4(),
+            provider_reference_id="EXISTING",
+            nhs_number_hash=generate_nhs_number_hash_fast(
+                "9728002440", date(2012, 7, 19)
+            ),
+        )
+        csv_file = SimpleUploadedFile(
+            "patients_test_data.csv",
+            b"NHS_NUMBER,BIRTH_DATE,FAMILY_NAME,GIVEN_NAME,PROVIDER_REFERENCE_ID\n"
+            b"9728002440,2012-07-19,Simon,Orpah Carmel,CP_066D4889\n"
+            b"9728002459,20-08-20,Leask,Owen Oscar,CP_F0D3F75B\n",
+            content_type="text/csv",
+        )
+        with mock.patch.object(
+            ManagementAPIClient,
+            ManagementAPIClient.create_subscription.__name__,
+            MagicMock(side_effect=lambda **_: uuid4()),
+        ):
+            response = self._get_upload_file_response(csv_file)
+            messages = self._convert_messages_to_str(response)
+
+        # the NHS number of line 0 is checked after the fields of line 1, but is still reported first
+        self.assertLess(
+            messages.index("CP_066D4889 (line 0)"),
+            messages.index("CP_F0D3F75B (line 1)"),
+        )
+
+    def test_admin_upload_csv_file_with_conflicting_row_saved_during_import(self):
+        existing_care_recipient = self.location.carerecipient_set.create(
+            subscription_id=uuid4(),
+            provider_reference_id="EXISTING",
+            nhs_number_hash=b"1234567",
+        )
+        csv_file = self._upload_test_data("patients_test_data.csv")
+        csv_file.seek(0)
+        lines_count = len(csv_file.readlines())
+        csv_file.seek(0)
+        subscription_ids = [existing_care_recipient.subscription_id] + [
+            uuid4() for _ in range(lines_count - 2)
+        ]
+        with mock.patch.object(
+            ManagementAPIClient,
+            ManagementAPIClient.create_subscription.__name__,
+            MagicMock(side_effect=subscription_ids),
+        ):
+            response = self._get_upload_file_response(csv_file)
+            messages = self._convert_messages_to_str(response)
+
+        self.assertIn("already exists", messages)
+        self.assertEqual(CareRecipient.objects.count(), lines_count - 1)
+
+    def test_admin_upload_csv_file_with_duplicated_nhs_number(self):
+        csv_file = self._upload_test_data(
+            "patients_duplicated_nhs_number_test_data.csv"
+        )
+        with mock.patch.object(
+            ManagementAPIClient,
+            ManagementAPIClient.create_subscription.__name__,
+            MagicMock(side_effect=lambda **_: uuid4()),
+        ) as create_subscription_mocked:
+            response = self._get_upload_file_response(csv_file)
+            messages = self._convert_messages_to_str(response)
+
+        self.assertIn("CP_90C1E159 (line 2)", messages)
+        self.assertIn("already exists in the file", messages)
+        self.assertEqual(create_subscription_mocked.call_count, 2)
+        self.assertEqual(CareRecipient.objects.count(), 2)
+
+    def test_admin_upload_csv_file_with_connection_error_for_one_row(self):
+        def create_subscription(nhs_number, **_):
+            if nhs_number == "9728002440":
+                raise requests.ConnectionError("Connection refused")
+            return uuid4()
+
+        csv_file = self._upload_test_data("patients_test_data.csv")
+        with mock.patch.object(
+            ManagementAPIClient,
+            ManagementAPIClient.create_subscription.__name__,
+            MagicMock(side_effect=create_subscription),
+        ) as create_subscription_mocked:
+            response = self._get_upload_file_response(csv_file)
+            csv_file.seek(0)
+            lines_count = len(csv_file.readlines())
+            messages = self._convert_messages_to_str(response)
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertIn("CP_066D4889 (line 0)", messages)
+        self.assertIn("Connection refused", messages)
+        self.assertEqual(create_subscription_mocked.call_count, lines_count - 1)
+        self.assertEqual(CareRecipient.objects.count(), lines_count - 2)
+
 
 class AdminCareRecipientTests(TestCase):
     def setUp(self) -> None:
@@ -194,7 +445,7 @@ class AdminCareRecipientTests(TestCase):
     ):
         care_recipient = CareRecipient.objects.create(
             care_provider_location=self.location,
-            nhs_number_hash="1234567",
+            nhs_number_hash=b"1234567",
             subscription_id=uuid4(),
             provider_reference_id="AX812938",
         )
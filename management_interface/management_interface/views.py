@@ -33,9 +33,9 @@ def care_provider_search(request):
 
         try:
             care_provider = CareProviderLocation.objects.get(
-                carerecipient__nhs_number_hash=nhs_number_hash
+                carerecipient__nhs_number_hash=bytes.fromhex(nhs_number_hash)
             )
-        except CareProviderLocation.DoesNotExist:
+        except (ValueError, CareProviderLocation.DoesNotExist):
             return failure_response(
                 status=HTTPStatus.NOT_FOUND,
                 code="not-found",